@@ -1,18 +1,27 @@
 #!/usr/bin/env python3
+import json
 import logging
 import sqlite3
 import re
+import zlib
 from typing import List, Optional
 
-from fastapi import FastAPI, HTTPException, Security, Depends
+from fastapi import FastAPI, HTTPException, Security, Depends, Request
 from fastapi.security.api_key import APIKeyHeader
-from pydantic import BaseModel, validator, Field
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel, ValidationError, validator, Field
 
 DATABASE_NAME = "olympiad_bot/olympiad_portal.db"
 API_KEY_NAME = "X-API-KEY"
 # THIS IS A DEMO API KEY. In a real application, use a secure way to store and manage API keys.
 VALID_API_KEY = "your_secret_api_key_here" 
 
+# Streaming NDJSON ingestion: rows are staged in chunks of this size, so memory does not grow with the upload
+NDJSON_CHUNK_SIZE = 1000
+NDJSON_MAX_LINE_BYTES = 64 * 1024
+NDJSON_DECOMPRESS_BYTES = 256 * 1024  # Max decompressed bytes per step, guards against gzip bombs
+NDJSON_MAX_ERRORS = 100
+
 api_key_header = APIKeyHeader(name=API_KEY_NAME, auto_error=True)
 
 app = FastAPI(title="Olympiad Results API", version="1.0.0")
@@ -21,8 +30,8 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # --- Database Helper Functions (similar to bot, but adapted for API context) ---
-def get_db_connection():
-    conn = sqlite3.connect(DATABASE_NAME)
+def get_db_connection(check_same_thread: bool = True):
+    conn = sqlite3.connect(DATABASE_NAME, check_same_thread=check_same_thread)
     conn.row_factory = sqlite3.Row # Allows accessing columns by name
     return conn
 
@@ -110,6 +119,123 @@ async def add_olympiad_results(
     conn.close()
     return {"message": "Results added successfully", "added_count": added_count}
 
+async def iter_gzip_ndjson_lines(request: Request):
+    """ decompress the gzip request body as it arrives and yield its lines one by one """
+    decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)  # gzip header/trailer
+    buffer = b""
+    try:
+        async for chunk in request.stream():
+            while chunk:
+                if decompressor.eof:
+                    # Concatenated gzip members (cat a.gz b.gz, pigz): continue with the next member.
+                    # Trailing garbage is not a valid gzip header and fails with zlib.error below.
+                    decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+                buffer += decompressor.decompress(chunk, NDJSON_DECOMPRESS_BYTES)
+                chunk = decompressor.unused_data if decompressor.eof else decompressor.unconsumed_tail
+                *lines, buffer = buffer.split(b"\n")
+                if len(buffer) > NDJSON_MAX_LINE_BYTES:
+                    raise HTTPException(status_code=400, detail=f"NDJSON line exceeds {NDJSON_MAX_LINE_BYTES} bytes")
+                for line in lines:
+                    yield line
+        buffer += decompressor.flush()
+    except zlib.error as e:
+        raise HTTPException(status_code=400, detail=f"Invalid gzip body: {e}")
+    if not decompressor.eof:
+        raise HTTPException(status_code=400, detail="Truncated gzip body")
+    if buffer:
+        yield buffer
+
+# Blocking SQLite steps of the NDJSON endpoint; they run in the threadpool so only stream reads use the event loop
+def open_ndjson_staging(olympiad_id: int):
+    """ return a connection with an empty TEMP staging table, or None if the olympiad does not exist """
+    # Used from threadpool threads one call at a time, never concurrently
+    conn = get_db_connection(check_same_thread=False)
+    try:
+        if not conn.execute("SELECT id FROM Olympiads WHERE id = ?", (olympiad_id,)).fetchone():
+            conn.close()
+            return None
+        # Rows are staged in a connection-private TEMP table while the body streams in, so no lock on the
+        # main database is held across network reads; Results is written in one short transaction at the end.
+        # temp_store = FILE keeps the staged rows on disk instead of in memory.
+        conn.execute("PRAGMA temp_store = FILE")
+        conn.execute("""CREATE TEMP TABLE ndjson_staging (
+                            user_snils TEXT NOT NULL, full_name TEXT NOT NULL,
+                            score INTEGER, place INTEGER, diploma_link TEXT)""")
+    except BaseException:
+        conn.close()
+        raise
+    return conn
+
+def stage_ndjson_rows(conn, rows: list):
+    conn.executemany("""INSERT INTO temp.ndjson_staging (user_snils, full_name, score, place, diploma_link)
+                        VALUES (?, ?, ?, ?, ?)""", rows)
+    conn.commit()
+
+def copy_staged_results(conn, olympiad_id: int):
+    conn.execute("""INSERT INTO Results (olympiad_id, user_snils, full_name, score, place, diploma_link)
+                    SELECT ?, user_snils, full_name, score, place, diploma_link FROM temp.ndjson_staging""",
+                 (olympiad_id,))
+    conn.commit()
+
+@app.post("/api/v1/results/ndjson", status_code=201)
+async def add_olympiad_results_ndjson(
+    olympiad_id: int,
+    request: Request,
+    api_key: str = Depends(get_api_key)
+):
+    conn = await run_in_threadpool(open_ndjson_staging, olympiad_id)
+    if conn is None:
+        raise HTTPException(status_code=404, detail=f"Olympiad with id {olympiad_id} not found")
+    try:
+        added_count = 0
+        errors = []
+        error_count = 0
+        chunk = []
+
+        line_number = 0
+        async for line in iter_gzip_ndjson_lines(request):
+            line_number += 1
+            if not line.strip():
+                continue
+            try:
+                result_item = ResultItem(**json.loads(line))
+            except (ValueError, TypeError, ValidationError) as e: # json.JSONDecodeError is a ValueError
+                error_count += 1
+                if len(errors) < NDJSON_MAX_ERRORS:
+                    errors.append({"line": line_number, "error": "Validation error", "detail": str(e)})
+                continue
+            # Once the batch is known to fail, keep validating to report errors but stop staging rows
+            if error_count:
+                continue
+            chunk.append((result_item.snils, result_item.full_name,
+                          result_item.score, result_item.place, result_item.diploma_link))
+            if len(chunk) >= NDJSON_CHUNK_SIZE:
+                added_count += len(chunk)
+                await run_in_threadpool(stage_ndjson_rows, conn, chunk)
+                chunk = []
+
+        if error_count:
+            raise HTTPException(status_code=400, detail={"message": "Error processing some results",
+                                                         "error_count": error_count, "errors": errors})
+        if chunk:
+            added_count += len(chunk)
+            await run_in_threadpool(stage_ndjson_rows, conn, chunk)
+        if not added_count:
+            raise HTTPException(status_code=400, detail="Results cannot be empty")
+
+        await run_in_threadpool(copy_staged_results, conn, olympiad_id)
+    except sqlite3.Error as e:
+        logger.error(f"DB error during NDJSON ingestion: {e}")
+        conn.rollback()
+        raise HTTPException(status_code=400, detail={"message": "Database error while adding results", "detail": str(e)})
+    except BaseException:
+        # Includes client disconnects mid-stream: nothing from this upload may reach Results
+        conn.rollback()
+        raise
+    finally:
+        conn.close() # Also drops the TEMP staging table
+    return {"message": "Results added successfully", "added_count": added_count}
+
 # --- To run this API (example command, not executed by the agent directly) ---
 # uvicorn api_server:app --host 0.0.0.0 --port 8000
 
@@ -3,6 +3,31 @@ import sqlite3
 
 DATABASE_NAME = "olympiad_bot/olympiad_portal.db"
 
+# Added after the first release: the bot also applies these on start (see create_result_cards_schema),
+# so databases created by an older database_setup.py keep working without a manual re-run
+RESULT_CARDS_SCHEMA = [
+    # Per-olympiad participant counts and ranks for /myresults
+    "CREATE INDEX IF NOT EXISTS idx_results_olympiad_score ON Results (olympiad_id, score);",
+    "CREATE INDEX IF NOT EXISTS idx_results_user_snils ON Results (user_snils);",
+    # One row per result: a card re-rendered with new data replaces the stale file_id
+    """
+    CREATE TABLE IF NOT EXISTS ResultCards (
+        result_id INTEGER PRIMARY KEY,
+        cache_key TEXT NOT NULL, -- sha256 of the fields drawn on the card
+        file_id TEXT NOT NULL, -- Telegram file_id of the uploaded card
+        FOREIGN KEY (result_id) REFERENCES Results (id) ON DELETE CASCADE
+    );
+    """,
+]
+
+def create_result_cards_schema(conn):
+    """ create the result card table and Results indexes, raising sqlite3.Error on failure
+    :param conn: Connection object
+    """
+    for statement in RESULT_CARDS_SCHEMA:
+        conn.execute(statement)
+    conn.commit()
+
 def create_connection():
     """ create a database connection to the SQLite database """
     conn = None
@@ -69,6 +94,9 @@ def main():
         print("Users table created (or already exists).")
         create_table(conn, sql_create_results_table)
         print("Results table created (or already exists).")
+        for statement in RESULT_CARDS_SCHEMA:
+            create_table(conn, statement)
+        print("ResultCards table and Results indexes created (or already exist).")
         conn.close()
     else:
         print("Error! cannot create the database connection.")
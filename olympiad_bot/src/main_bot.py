@@ -1,11 +1,13 @@
 #!/usr/bin/env python3
+import asyncio
 import logging
 import sqlite3
 import re # For SNILS validation
 from datetime import datetime # For date validation
 from functools import wraps # For admin decorator
 
-from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove, InputFile
+from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove, InputFile, InputMediaPhoto
+from telegram.error import BadRequest
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -16,6 +18,17 @@ from telegram.ext import (
 )
 import os
 
+from database_setup import create_result_cards_schema
+from result_cards import (
+    IMAGES_DIR,
+    card_cache_key,
+    discard_result_card,
+    get_result_card,
+    prune_card_cache,
+    result_card_fields,
+    shutdown_card_executor,
+)
+
 # Enable logging
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
@@ -26,10 +39,9 @@ DATABASE_NAME = "olympiad_bot/olympiad_portal.db"  # Changed from database_setup
 TELEGRAM_BOT_TOKEN = "xxxxxxxxxxx"  # Placeholder
 
 # Define the image paths
-IMAGES_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "images")
-RESULTS_IMAGE = os.path.join(IMAGES_DIR, "results.png")
 PROFILE_IMAGE = os.path.join(IMAGES_DIR, "profile.png")
 OLYMPIADS_IMAGE = os.path.join(IMAGES_DIR, "olympiads.png")
+MEDIA_GROUP_SIZE = 10  # Telegram limit for sendMediaGroup
 
 # Conversation states
 # /mydata
@@ -91,6 +103,66 @@ def is_admin(telegram_id: int) -> bool:
     conn.close()
     return bool(result["is_admin"]) if result and result["is_admin"] == 1 else False
 
+def fetch_user_results(user_snils: str):
+    """ return (results, cards_available); the second is False when the card table is missing """
+    # Runs in a worker thread: ranking over large olympiads must not block the event loop
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT r.id, o.name, o.date, o.subject, r.full_name, r.score, r.place, r.diploma_link,
+                   stats.participants, stats.scored_below, rc.cache_key AS card_cache_key, rc.file_id AS card_file_id
+            FROM Results r
+            JOIN Olympiads o ON r.olympiad_id = o.id
+            JOIN (
+                SELECT mine.id AS result_id,
+                       COUNT(other.score) AS participants, -- results without a score are not ranked
+                       COALESCE(SUM(other.score < mine.score), 0) AS scored_below
+                FROM Results mine
+                JOIN Results other ON other.olympiad_id = mine.olympiad_id
+                WHERE mine.user_snils = ?
+                GROUP BY mine.id
+            ) stats ON stats.result_id = r.id
+            LEFT JOIN ResultCards rc ON rc.result_id = r.id
+            WHERE r.user_snils = ?
+            ORDER BY o.date DESC, o.name
+        """, (user_snils, user_snils))
+        return cursor.fetchall(), True
+    except sqlite3.OperationalError as e:
+        logger.error(f"Result cards unavailable, falling back to text: {e}")
+        cursor.execute("""
+            SELECT o.name, o.date, o.subject, r.full_name, r.score, r.place, r.diploma_link
+            FROM Results r
+            JOIN Olympiads o ON r.olympiad_id = o.id
+            WHERE r.user_snils = ?
+            ORDER BY o.date DESC, o.name
+        """, (user_snils,))
+        return cursor.fetchall(), False
+    finally:
+        conn.close()
+
+def apply_result_cards_schema():
+    conn = get_db_connection()
+    try:
+        create_result_cards_schema(conn)
+    finally:
+        conn.close()
+
+def save_card_file_id(result_id: int, cache_key: str, file_id):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        if file_id:
+            cursor.execute("INSERT OR REPLACE INTO ResultCards (result_id, cache_key, file_id) VALUES (?, ?, ?)",
+                           (result_id, cache_key, file_id))
+        else:
+            cursor.execute("DELETE FROM ResultCards WHERE result_id = ?", (result_id,))
+        conn.commit()
+    except sqlite3.Error as e:
+        logger.error(f"Database error saving card file_id for result {result_id}: {e}")
+    finally:
+        conn.close()
+
 # --- Input Validation ---
 def validate_snils_format(snils: str) -> bool:
     return bool(re.fullmatch(r"\d{3}-\d{3}-\d{3} \d{2}", snils))
@@ -206,43 +278,99 @@ async def mydata_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
     return ConversationHandler.END
 
 # --- /myresults Command ---
+def format_result_text(row) -> str:
+    return (
+        f"Олимпиада: {row['name']} ({row['date']})\n"
+        f"Предмет: {row['subject'] if row['subject'] else '-'}\n"
+        f"ФИО: {row['full_name']}\n"
+        f"Баллы: {row['score'] if row['score'] is not None else '-'}\n"
+        f"Место: {row['place'] if row['place'] is not None else '-'}\n"
+        f"Диплом: {row['diploma_link'] if row['diploma_link'] else 'Нет'}\n"
+    )
+
+async def render_result_cards(cards: list) -> None:
+    # All misses are submitted at once so the process pool renders them in parallel
+    paths = await asyncio.gather(*(get_result_card(card["fields"], card["cache_key"]) for card in cards),
+                                 return_exceptions=True)
+    for card, path in zip(cards, paths):
+        if isinstance(path, Exception):
+            logger.error(f"Error rendering result card {card['cache_key']}: {path!r}")
+            continue
+        with open(path, 'rb') as card_file:
+            card["photo"] = card_file.read()
+
+async def send_card_batch(update: Update, batch: list) -> None:
+    media = [(card["file_id"] or card["photo"], f"Диплом: {card['row']['diploma_link'] or 'Нет'}") for card in batch]
+    if len(media) == 1:
+        # sendMediaGroup needs at least two items
+        messages = [await update.message.reply_photo(photo=media[0][0], caption=media[0][1])]
+    else:
+        messages = await update.message.reply_media_group(
+            media=[InputMediaPhoto(media=photo, caption=caption) for photo, caption in media]
+        )
+    for card, message in zip(batch, messages):
+        if card["file_id"] or not message.photo:
+            continue
+        # Telegram keeps the photo now: reuse its file_id and drop the PNG from the disk cache
+        save_card_file_id(card["row"]["id"], card["cache_key"], message.photo[-1].file_id)
+        discard_result_card(card["cache_key"])
+
+def build_result_cards(results) -> list:
+    cards = []
+    for row in results:
+        fields = result_card_fields(row)
+        cache_key = card_cache_key(fields)
+        # A stored file_id is only valid for the exact fields it was rendered from
+        file_id = row["card_file_id"] if row["card_cache_key"] == cache_key else None
+        cards.append({"row": row, "fields": fields, "cache_key": cache_key, "file_id": file_id, "photo": None})
+    return cards
+
+async def send_result_cards(update: Update, results) -> None:
+    cards = build_result_cards(results)
+    await render_result_cards([card for card in cards if not card["file_id"]])
+
+    ready = [card for card in cards if card["file_id"] or card["photo"]]
+    for card in cards:
+        if not (card["file_id"] or card["photo"]):
+            await update.message.reply_text(format_result_text(card["row"]))
+    for i in range(0, len(ready), MEDIA_GROUP_SIZE):
+        batch = ready[i:i + MEDIA_GROUP_SIZE]
+        try:
+            await send_card_batch(update, batch)
+        except BadRequest as e:
+            stale = [card for card in batch if card["file_id"]]
+            if not stale:
+                raise
+            logger.warning(f"Cached card file_id rejected, uploading again: {e}")
+            for card in stale:
+                save_card_file_id(card["row"]["id"], card["cache_key"], None)
+                card["file_id"] = None
+            await render_result_cards(stale)
+            for card in batch:
+                if not card["photo"]:
+                    await update.message.reply_text(format_result_text(card["row"]))
+            batch = [card for card in batch if card["photo"]]
+            if batch:
+                await send_card_batch(update, batch)
+
 async def myresults_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    # First send the results image
-    if os.path.exists(RESULTS_IMAGE):
-        await update.message.reply_photo(photo=open(RESULTS_IMAGE, 'rb'))
-    
-    # Then continue with the existing functionality
     user_id = update.effective_user.id
     user_snils = get_user_snils(user_id)
     if not user_snils:
         await update.message.reply_text("Сначала привяжите ваш СНИЛС с помощью команды /mydata.")
         return
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT o.name, o.date, o.subject, r.full_name, r.score, r.place, r.diploma_link
-        FROM Results r
-        JOIN Olympiads o ON r.olympiad_id = o.id
-        WHERE r.user_snils = ?
-        ORDER BY o.date DESC, o.name
-    """, (user_snils,))
-    results = cursor.fetchall()
-    conn.close()
+    results, cards_available = await asyncio.to_thread(fetch_user_results, user_snils)
     if not results:
         await update.message.reply_text(f"Результаты для СНИЛС {user_snils} не найдены.")
         return
-    response_text = f"Ваши результаты (СНИЛС: {user_snils}):\n\n"
-    for row in results:
-        response_text += (
-            f"Олимпиада: {row['name']} ({row['date']})\n"
-            f"Предмет: {row['subject'] if row['subject'] else '-'}\n"
-            f"ФИО: {row['full_name']}\n"
-            f"Баллы: {row['score'] if row['score'] is not None else '-'}\n"
-            f"Место: {row['place'] if row['place'] is not None else '-'}\n"
-            f"Диплом: {row['diploma_link'] if row['diploma_link'] else 'Нет'}\n"
-            f"--------------------\n"
-        )
-    await update.message.reply_text(response_text)
+    if not cards_available:
+        response_text = f"Ваши результаты (СНИЛС: {user_snils}):\n\n"
+        for row in results:
+            response_text += format_result_text(row) + "--------------------\n"
+        await update.message.reply_text(response_text)
+        return
+    await update.message.reply_text(f"Ваши результаты (СНИЛС: {user_snils}):")
+    await send_result_cards(update, results)
 
 # --- /listolympiads Command ---
 async def listolympiads_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -435,13 +563,32 @@ async def admin_edit_result_start(update: Update, context: ContextTypes.DEFAULT_
     return ConversationHandler.END # Placeholder
 
 # --- Main Bot Logic ---
+async def prepare_result_cards(application: Application) -> None:
+    # Databases created before result cards existed lack the table and indexes: add them on start
+    try:
+        await asyncio.to_thread(apply_result_cards_schema)
+    except sqlite3.Error as e:
+        logger.error(f"Could not create the result card schema, /myresults will answer with text: {e}")
+    removed = await asyncio.to_thread(prune_card_cache)
+    if removed:
+        logger.info(f"Removed {removed} stale cached result cards.")
+
+async def stop_card_renderer(application: Application) -> None:
+    shutdown_card_executor()
+
 def main() -> None:
     if TELEGRAM_BOT_TOKEN == "YOUR_TELEGRAM_BOT_TOKEN" or not TELEGRAM_BOT_TOKEN:
         logger.error("Telegram Bot Token is not configured. Please set it in main_bot.py")
         print("Telegram Bot Token is not configured. Please set it in main_bot.py")
         return
 
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+    application = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .post_init(prepare_result_cards)
+        .post_shutdown(stop_card_renderer)
+        .build()
+    )
 
     application.add_handler(CommandHandler("start", start_command))
     application.add_handler(CommandHandler("help", help_command))
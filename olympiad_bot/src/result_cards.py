@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+import asyncio
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+
+from PIL import Image, ImageDraw, ImageFont
+
+IMAGES_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "images")
+RESULTS_IMAGE = os.path.join(IMAGES_DIR, "results.png")
+CARDS_CACHE_DIR = os.path.join(IMAGES_DIR, "cards")
+
+# Bump when the card layout changes so stale cached PNGs (and their file_ids) are not reused
+CARD_LAYOUT_VERSION = 2
+CARD_SIZE = (1400, 400)
+CARD_FONT_NAME = "DejaVuSans.ttf"  # Needs Cyrillic glyphs; the PIL bitmap fallback has none
+# Cards are kept on disk only until their file_id is stored; leftovers (e.g. failed uploads) expire after this
+CARD_CACHE_MAX_AGE = 24 * 60 * 60
+RENDER_WORKERS = max(1, min(4, (os.cpu_count() or 1) - 1))
+
+_executor = None
+_pending_renders = {}  # cache_key -> asyncio.Future, so concurrent requests for one card render it once
+
+# --- Card Data ---
+def percentile_rank(scored_below: int, participants: int) -> int:
+    """ share of participants (in %) with a strictly lower score """
+    if not participants:
+        return 0
+    return round(100 * scored_below / participants)
+
+def result_card_fields(row) -> dict:
+    # Everything drawn on the card goes here: the cache key is derived from these fields only.
+    # Without a score there is no rank, so neither the participant count nor the percentile is shown.
+    has_score = row["score"] is not None
+    return {
+        "full_name": row["full_name"],
+        "olympiad": row["name"],
+        "date": row["date"],
+        "subject": row["subject"],
+        "score": row["score"],
+        "place": row["place"],
+        "participants": row["participants"] if has_score else None,
+        "percentile": percentile_rank(row["scored_below"], row["participants"]) if has_score else None,
+    }
+
+def card_cache_key(fields: dict) -> str:
+    payload = json.dumps({"v": CARD_LAYOUT_VERSION, **fields}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def card_cache_path(cache_key: str, cache_dir: str = CARDS_CACHE_DIR) -> str:
+    return os.path.join(cache_dir, f"{cache_key}.png")
+
+def discard_result_card(cache_key: str, cache_dir: str = CARDS_CACHE_DIR) -> None:
+    try:
+        os.remove(card_cache_path(cache_key, cache_dir))
+    except FileNotFoundError:
+        pass
+
+def prune_card_cache(max_age: float = CARD_CACHE_MAX_AGE, cache_dir: str = CARDS_CACHE_DIR) -> int:
+    """ delete cached cards (and stray temp files) not modified for max_age seconds """
+    if not os.path.isdir(cache_dir):
+        return 0
+    removed = 0
+    expired_before = time.time() - max_age
+    for entry in os.scandir(cache_dir):
+        try:
+            if entry.is_file() and entry.stat().st_mtime < expired_before:
+                os.remove(entry.path)
+                removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
+
+# --- Rendering (runs in worker processes) ---
+@lru_cache(maxsize=None)
+def _load_font(size: int):
+    # No fallback to ImageFont.load_default(): it cannot draw Cyrillic, and a broken card would be cached.
+    # The OSError reaches the caller, which answers with text instead (failures are not cached by lru_cache).
+    return ImageFont.truetype(CARD_FONT_NAME, size)
+
+@lru_cache(maxsize=1)
+def _card_background():
+    # Decoding and resizing results.png costs ~30 ms, so each worker process does it once
+    if os.path.exists(RESULTS_IMAGE):
+        return Image.open(RESULTS_IMAGE).convert("RGB").resize(CARD_SIZE)
+    return Image.new("RGB", CARD_SIZE, (32, 54, 96))
+
+def render_result_card(fields: dict, path: str) -> str:
+    card = _card_background().copy()
+    draw = ImageDraw.Draw(card)
+    width, height = CARD_SIZE
+
+    # Darken the background so the text stays readable on top of the stock picture
+    draw.rectangle((40, 30, width - 40, height - 30), fill=(20, 24, 40))
+
+    title_font, text_font, small_font = _load_font(44), _load_font(32), _load_font(26)
+    olympiad_line = fields["olympiad"]
+    if fields["subject"]:
+        olympiad_line += f" — {fields['subject']}"
+    draw.text((80, 55), fields["full_name"], font=title_font, fill=(255, 255, 255))
+    draw.text((80, 120), f"{olympiad_line} ({fields['date']})", font=text_font, fill=(200, 210, 230))
+
+    score = fields["score"] if fields["score"] is not None else "-"
+    place_line = f"Место: {fields['place'] if fields['place'] is not None else '-'}"
+    if fields["participants"] is not None:
+        place_line += f" из {fields['participants']}"
+    draw.text((80, 185), f"Баллы: {score}", font=text_font, fill=(255, 255, 255))
+    draw.text((480, 185), place_line, font=text_font, fill=(255, 255, 255))
+
+    if fields["percentile"] is not None:
+        _draw_percentile_bar(draw, fields["percentile"], small_font)
+
+    # Write to a temp name first: a half-written file must never be picked up as a cache hit.
+    # The PNG is uploaded once and then deleted, so fast compression beats a smaller file.
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    card.save(tmp_path, format="PNG", compress_level=1)
+    os.replace(tmp_path, path)
+    return path
+
+def _draw_percentile_bar(draw, percentile: int, font) -> None:
+    width, _ = CARD_SIZE
+    bar_left, bar_top, bar_right, bar_bottom = 80, 275, width - 80, 305
+    draw.rectangle((bar_left, bar_top, bar_right, bar_bottom), fill=(60, 66, 90))
+    filled = bar_left + (bar_right - bar_left) * percentile // 100
+    if filled > bar_left:
+        draw.rectangle((bar_left, bar_top, filled, bar_bottom), fill=(86, 196, 120))
+    draw.text((bar_left, 320), f"Лучше, чем {percentile}% участников", font=font, fill=(200, 210, 230))
+
+# --- Async API for the bot ---
+def get_card_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        # Not fork: the bot already runs network and to_thread workers, and a forked child can
+        # inherit a lock held by one of them and hang (which BrokenProcessPool would not catch)
+        _executor = ProcessPoolExecutor(max_workers=RENDER_WORKERS, mp_context=multiprocessing.get_context("forkserver"))
+    return _executor
+
+async def _render_in_pool(fields: dict, path: str) -> str:
+    global _executor
+    loop = asyncio.get_running_loop()
+    executor = get_card_executor()
+    try:
+        return await loop.run_in_executor(executor, render_result_card, fields, path)
+    except BrokenProcessPool:
+        # A worker died (OOM kill, crash in Pillow): the pool is unusable, start a fresh one and retry once
+        if _executor is executor:
+            _executor = None
+            executor.shutdown(wait=False)
+        return await loop.run_in_executor(get_card_executor(), render_result_card, fields, path)
+
+async def get_result_card(fields: dict, cache_key: str = None, cache_dir: str = CARDS_CACHE_DIR) -> str:
+    """ return the path to the rendered card, rendering it in the process pool on a cache miss """
+    cache_key = cache_key or card_cache_key(fields)
+    path = card_cache_path(cache_key, cache_dir)
+    if os.path.exists(path):
+        return path
+    pending = _pending_renders.get(cache_key)
+    if pending is not None:
+        return await asyncio.shield(pending)
+
+    future = asyncio.ensure_future(_render_in_pool(fields, path))
+    _pending_renders[cache_key] = future
+    future.add_done_callback(lambda _: _pending_renders.pop(cache_key, None))
+    return await asyncio.shield(future)
+
+def shutdown_card_executor() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+
+# --- Benchmark ---
+async def _measure_loop_lag(stop: asyncio.Event, interval: float, samples: list) -> None:
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(time.perf_counter() - started - interval)
+
+async def run_benchmark(cards: int) -> None:
+    cache_dir = tempfile.mkdtemp(prefix="result_cards_bench_")
+    fields_list = [
+        {
+            "full_name": f"Участник Номер {i}",
+            "olympiad": "Всероссийская олимпиада школьников",
+            "date": "2025-03-15",
+            "subject": "Математика",
+            "score": i % 100,
+            "place": i + 1,
+            "participants": cards,
+            "percentile": percentile_rank(cards - i - 1, cards),
+        }
+        for i in range(cards)
+    ]
+    # Warm up the pool so process start-up is not counted as render time
+    loop = asyncio.get_running_loop()
+    await asyncio.gather(*(loop.run_in_executor(get_card_executor(), os.getpid) for _ in range(RENDER_WORKERS)))
+    await get_result_card({**fields_list[0], "full_name": "warm-up"}, cache_dir=cache_dir)
+
+    stop = asyncio.Event()
+    lag_samples = []
+    lag_task = asyncio.create_task(_measure_loop_lag(stop, 0.005, lag_samples))
+    started = time.perf_counter()
+    await asyncio.gather(*(get_result_card(fields, cache_dir=cache_dir) for fields in fields_list))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await lag_task
+
+    lag_samples.sort()
+    p99 = lag_samples[min(len(lag_samples) - 1, int(len(lag_samples) * 0.99))] if lag_samples else 0.0
+    print(f"Rendered {cards} cards with {RENDER_WORKERS} workers in {elapsed:.2f}s: {cards / elapsed:.1f} cards/s")
+    print(f"Event loop lag during the burst: max {max(lag_samples, default=0.0) * 1000:.1f} ms, "
+          f"p99 {p99 * 1000:.1f} ms over {len(lag_samples)} samples")
+    print(f"Cards written to {cache_dir}")
+
+if __name__ == "__main__":
+    # Example: python3 result_cards.py 200
+    asyncio.run(run_benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 100))
+    shutdown_card_executor()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The bot and API are plain scripts run from olympiad_bot/src, not an installed package
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "olympiad_bot", "src"))
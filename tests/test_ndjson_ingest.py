@@ -0,0 +1,182 @@
+import gzip
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tracemalloc
+
+import pytest
+from fastapi.testclient import TestClient
+
+import api_server
+import database_setup
+
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    path = str(tmp_path / "olympiad_portal.db")
+    monkeypatch.setattr(database_setup, "DATABASE_NAME", path)
+    monkeypatch.setattr(api_server, "DATABASE_NAME", path)
+    database_setup.main()
+    conn = sqlite3.connect(path)
+    conn.execute("INSERT INTO Olympiads (id, name, date) VALUES (1, 'Test olympiad', '2025-03-15')")
+    conn.commit()
+    conn.close()
+    return path
+
+
+@pytest.fixture
+def client(db_path):
+    return TestClient(api_server.app)
+
+
+def ndjson_lines(count, start=0):
+    for i in range(start, start + count):
+        yield json.dumps({
+            "full_name": f"Участник {i}",
+            "snils": f"{i // 1000000 % 1000:03d}-{i // 1000 % 1000:03d}-{i % 1000:03d} {i % 100:02d}",
+            "score": i % 100,
+            "place": i + 1,
+        }, ensure_ascii=False).encode("utf-8") + b"\n"
+
+
+def post_ndjson(client, body, olympiad_id=1):
+    return client.post(
+        f"/api/v1/results/ndjson?olympiad_id={olympiad_id}",
+        content=body,
+        headers={"X-API-KEY": api_server.VALID_API_KEY, "Content-Encoding": "gzip"},
+    )
+
+
+def count_results(db_path):
+    conn = sqlite3.connect(db_path)
+    count = conn.execute("SELECT COUNT(*) FROM Results").fetchone()[0]
+    conn.close()
+    return count
+
+
+def test_adds_all_rows(client, db_path):
+    response = post_ndjson(client, gzip.compress(b"".join(ndjson_lines(2500))))
+    assert response.status_code == 201
+    assert response.json()["added_count"] == 2500
+    assert count_results(db_path) == 2500
+
+
+def test_bad_line_rolls_back_whole_upload(client, db_path):
+    lines = list(ndjson_lines(2500))
+    lines.insert(2000, b"\n")
+    lines.insert(2200, b'{"full_name": "Bad", "snils": "123", "score": 1, "place": 1}\n')
+    response = post_ndjson(client, gzip.compress(b"".join(lines)))
+    assert response.status_code == 400
+    detail = response.json()["detail"]
+    assert detail["error_count"] == 1
+    assert detail["errors"][0]["line"] == 2201  # physical, 1-based: the blank line is counted
+    assert count_results(db_path) == 0
+
+
+def test_concatenated_gzip_members(client, db_path):
+    body = gzip.compress(b"".join(ndjson_lines(1500))) + gzip.compress(b"".join(ndjson_lines(700, start=1500)))
+    response = post_ndjson(client, body)
+    assert response.status_code == 201
+    assert response.json()["added_count"] == 2200
+    assert count_results(db_path) == 2200
+
+
+def test_trailing_garbage_is_rejected(client, db_path):
+    response = post_ndjson(client, gzip.compress(b"".join(ndjson_lines(10))) + b"not gzip")
+    assert response.status_code == 400
+    assert count_results(db_path) == 0
+
+
+def test_unknown_olympiad(client, db_path):
+    response = post_ndjson(client, gzip.compress(b"".join(ndjson_lines(10))), olympiad_id=999)
+    assert response.status_code == 404
+
+
+# Flat memory is checked in three parts, none of which is enough alone:
+# - tracemalloc sees only the Python heap (decompression buffer, current chunk of ResultItem rows). It
+#   catches an endpoint that keeps every line or row in Python, but not SQLite's native page cache or the
+#   staging table, and the compressed body buffered by TestClient is subtracted from its peak.
+# - The staging table only stays off the heap if SQLite stores TEMP tables in a file, which is asserted directly.
+# - Process RSS is sampled during the upload to catch growth on the native side that tracemalloc cannot see.
+#   It runs in a fresh process, because memory freed by earlier tests stays in the allocator and hides growth,
+#   with a single glibc malloc arena so per-thread arenas of the threadpool do not add noise.
+# TestClient delivers the body in one ASGI message, so this does not exercise a slow network stream.
+
+def peak_memory_for_upload(client, rows):
+    body = gzip.compress(b"".join(ndjson_lines(rows)))
+    tracemalloc.start()
+    try:
+        response = post_ndjson(client, body)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert response.status_code == 201
+    assert response.json()["added_count"] == rows
+    return peak - len(body)
+
+
+def test_peak_python_memory_flat_as_rows_grow(client):
+    small_peak = peak_memory_for_upload(client, 10_000)
+    large_peak = peak_memory_for_upload(client, 100_000)
+    # 10x the rows must not mean noticeably more memory; the pydantic-list endpoint grows linearly here
+    assert large_peak < small_peak * 1.5 + 512 * 1024
+
+
+def test_staging_table_is_not_kept_in_memory(db_path):
+    conn = api_server.open_ndjson_staging(1)
+    try:
+        # SQLITE_TEMP_STORE=3 forces in-memory TEMP tables whatever the pragma says
+        assert ("TEMP_STORE=3",) not in conn.execute("PRAGMA compile_options").fetchall()
+        assert conn.execute("PRAGMA temp_store").fetchone()[0] == 1  # FILE
+    finally:
+        conn.close()
+
+
+RSS_CHILD = """
+import gzip, os, sys, threading, time
+sys.path[:0] = sys.argv[2:]
+import api_server, test_ndjson_ingest as t
+from fastapi.testclient import TestClient
+
+api_server.DATABASE_NAME = sys.argv[1]
+client = TestClient(api_server.app)
+bodies = {rows: gzip.compress(b"".join(t.ndjson_lines(rows))) for rows in (10_000, 100_000, 200_000)}
+
+def current_rss():
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+def peak_rss_during_upload(rows):
+    peak = [current_rss()]
+    stop = threading.Event()
+    def sample():
+        while not stop.is_set():
+            peak[0] = max(peak[0], current_rss())
+            time.sleep(0.002)
+    sampler = threading.Thread(target=sample)
+    sampler.start()
+    try:
+        assert t.post_ndjson(client, bodies[rows]).status_code == 201
+    finally:
+        stop.set()
+        sampler.join()
+    return peak[0]
+
+peak_rss_during_upload(10_000)  # warm up imports, allocator arenas and SQLite's bounded page caches
+peak_100k = peak_rss_during_upload(100_000)
+peak_200k = peak_rss_during_upload(200_000)
+print(peak_200k - peak_100k)
+"""
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="reads RSS from /proc")
+def test_peak_rss_flat_as_rows_grow(db_path):
+    tests_dir = os.path.dirname(os.path.abspath(__file__))
+    src_dir = os.path.join(os.path.dirname(tests_dir), "olympiad_bot", "src")
+    child = subprocess.run([sys.executable, "-c", RSS_CHILD, db_path, tests_dir, src_dir],
+                           capture_output=True, text=True, check=True, env={**os.environ, "MALLOC_ARENA_MAX": "1"})
+    growth = int(child.stdout.strip().splitlines()[-1])
+    # Doubling the rows adds under 1 MB here; an in-memory staging table adds about 5.5 MB
+    assert growth < 3 * 1024 * 1024
@@ -0,0 +1,126 @@
+import sqlite3
+
+import pytest
+from PIL import Image
+
+import database_setup
+import main_bot
+import result_cards
+
+SNILS = "111-222-333 44"
+
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    path = str(tmp_path / "olympiad_portal.db")
+    monkeypatch.setattr(database_setup, "DATABASE_NAME", path)
+    monkeypatch.setattr(main_bot, "DATABASE_NAME", path)
+    database_setup.main()
+    return path
+
+
+def insert_results(db_path, olympiad_name, date, scores, user_score="missing"):
+    """ add an olympiad with other participants' scores and, optionally, the user's own result """
+    conn = sqlite3.connect(db_path)
+    olympiad_id = conn.execute("INSERT INTO Olympiads (name, date, subject) VALUES (?, ?, ?)",
+                               (olympiad_name, date, "Математика")).lastrowid
+    for i, score in enumerate(scores):
+        conn.execute("INSERT INTO Results (olympiad_id, user_snils, full_name, score, place) VALUES (?, ?, ?, ?, ?)",
+                     (olympiad_id, f"000-000-{i:03d} 00", f"Участник {i}", score, i + 1))
+    result_id = None
+    if user_score != "missing":
+        result_id = conn.execute("INSERT INTO Results (olympiad_id, user_snils, full_name, score, place) VALUES (?, ?, ?, ?, ?)",
+                                 (olympiad_id, SNILS, "Иванов Иван", user_score, 2)).lastrowid
+    conn.commit()
+    conn.close()
+    return result_id
+
+
+def test_percentile_rank():
+    assert result_cards.percentile_rank(0, 0) == 0
+    assert result_cards.percentile_rank(0, 1) == 0
+    assert result_cards.percentile_rank(3, 4) == 75
+    assert result_cards.percentile_rank(2, 3) == 67
+
+
+def test_fetch_user_results_ranks_per_olympiad(db_path):
+    # Ties are not "better than", NULL scores are not participants, other olympiads do not count
+    insert_results(db_path, "Первая", "2025-03-01", [10, 50, 50, 90, None], user_score=50)
+    insert_results(db_path, "Вторая", "2025-04-01", [1, 2, 3], user_score=100)
+    insert_results(db_path, "Чужая", "2025-05-01", [5, 6, 7])
+
+    results, cards_available = main_bot.fetch_user_results(SNILS)
+
+    assert cards_available
+    stats = {row["name"]: (row["participants"], row["scored_below"]) for row in results}
+    assert stats == {"Первая": (5, 1), "Вторая": (4, 3)}
+    assert [row["name"] for row in results] == ["Вторая", "Первая"]  # newest first
+
+
+def test_result_without_score_has_no_rank(db_path):
+    insert_results(db_path, "Первая", "2025-03-01", [10, 20], user_score=None)
+    results, _ = main_bot.fetch_user_results(SNILS)
+
+    fields = result_cards.result_card_fields(results[0])
+    assert results[0]["participants"] == 2
+    assert fields["participants"] is None
+    assert fields["percentile"] is None
+
+
+def test_missing_card_table_falls_back_to_text(db_path):
+    insert_results(db_path, "Первая", "2025-03-01", [10], user_score=20)
+    conn = sqlite3.connect(db_path)
+    conn.execute("DROP TABLE ResultCards")
+    conn.commit()
+    conn.close()
+
+    results, cards_available = main_bot.fetch_user_results(SNILS)
+    assert not cards_available
+    assert results[0]["score"] == 20
+
+    main_bot.apply_result_cards_schema()
+    _, cards_available = main_bot.fetch_user_results(SNILS)
+    assert cards_available
+
+
+def test_card_cache_key_depends_on_every_field():
+    fields = {"full_name": "Иванов Иван", "olympiad": "Первая", "date": "2025-03-01", "subject": None,
+              "score": 50, "place": 2, "participants": 5, "percentile": 20}
+    key = result_cards.card_cache_key(fields)
+    assert key == result_cards.card_cache_key(dict(reversed(list(fields.items()))))
+    for name, value in [("full_name", "Петров"), ("olympiad", "Вторая"), ("date", "2025-03-02"),
+                        ("subject", "Физика"), ("score", 51), ("place", 1), ("participants", 6), ("percentile", 21)]:
+        assert result_cards.card_cache_key({**fields, name: value}) != key, name
+
+
+def test_file_id_reused_only_for_matching_key(db_path):
+    result_id = insert_results(db_path, "Первая", "2025-03-01", [10, 90], user_score=50)
+    results, _ = main_bot.fetch_user_results(SNILS)
+    card = main_bot.build_result_cards(results)[0]
+    assert card["file_id"] is None
+
+    main_bot.save_card_file_id(result_id, card["cache_key"], "FILE-1")
+    results, _ = main_bot.fetch_user_results(SNILS)
+    assert main_bot.build_result_cards(results)[0]["file_id"] == "FILE-1"
+
+    # A new upload changes the participant count, so the stored card is stale
+    conn = sqlite3.connect(db_path)
+    conn.execute("INSERT INTO Results (olympiad_id, user_snils, full_name, score, place) VALUES (1, '000-000-999 00', 'Новый', 70, 3)")
+    conn.commit()
+    conn.close()
+    results, _ = main_bot.fetch_user_results(SNILS)
+    stale = main_bot.build_result_cards(results)[0]
+    assert stale["cache_key"] != card["cache_key"]
+    assert stale["file_id"] is None
+
+
+def test_render_result_card(tmp_path):
+    try:
+        result_cards._load_font(26)
+    except OSError:
+        pytest.skip("DejaVu Sans is not installed")
+    fields = {"full_name": "Иванов Иван", "olympiad": "Первая", "date": "2025-03-01", "subject": None,
+              "score": None, "place": None, "participants": None, "percentile": None}
+    path = result_cards.render_result_card(fields, str(tmp_path / "cards" / "card.png"))
+    with Image.open(path) as card:
+        assert card.size == result_cards.CARD_SIZE